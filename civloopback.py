@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+Date    : 10/2026
+
+A small stand-in for an ic9700/ic9100 behind a ser2net-like tcp serial server.
+It accepts raw CI-V frames on a tcp port and answers like the transceiver does,
+so gp2icom and the tcp transport of icom.py can be tried without a radio.
+
+Usage:
+1) python civloopback.py 4533 [answer delay in ms, to try a slow network]
+2) use ICOM_TRX = ('tcp://127.0.0.1:4533', '115200', 162) in gp2icom.py
+"""
+
+import socket
+import sys
+import threading
+import time
+
+
+def toBcd(freq):
+    freq = ('0000000000' + freq)[-10:]
+    return bytes([int(freq[8:10], 16), int(freq[6:8], 16), int(freq[4:6], 16),
+                  int(freq[2:4], 16), int(freq[0:2], 16)])
+
+
+# tens of MHz of the frequency as band marker, like 14 for 145.900 MHz or 43 for 435.000 MHz
+def bandOfBcd(b):
+    return int('%0.2X%0.2X' % (b[4], b[3])) // 10
+
+
+class LoopbackRadio:
+    # settings of a VFO with their default value
+    VFO_SETTINGS = {b'\x16\x42': b'\x00', b'\x1b\x00': b'\x00\x08\x85', b'\x1a\x06': b'\x00\x00'}
+
+    def __init__(self, port, icomTrxCivAdress=162, host='127.0.0.1', delay=0.0):
+        self.host = host
+        self.delay = delay  # seconds before every answer
+        self.port = port
+        self.icomTrxCivAdress = icomTrxCivAdress
+        self.band = 'MAIN'
+        self.vfo = {'MAIN': 'VFOA', 'SUB': 'VFOA'}
+        # (band, vfo) -> frequency bytes in CI-V bcd order
+        self.frequency = {('MAIN', 'VFOA'): toBcd('435000000'), ('MAIN', 'VFOB'): toBcd('435000000'),
+                          ('SUB', 'VFOA'): toBcd('145900000'), ('SUB', 'VFOB'): toBcd('145900000')}
+        self.mode = {}  # (band, vfo) -> mode bytes
+        self.settings = {}  # 0x16 subcommand -> value, like dual watch or satellite mode
+        self.vfoSettings = {}  # (band, vfo, command) -> value of tone (16 42), tone frequency (1B 00) and data mode (1A 06)
+        self.split = b'\x00'
+        self.sock = None
+
+    def __answer(self, payload):
+        return bytes([254, 254, 0, self.icomTrxCivAdress]) + payload + bytes([253])
+
+    def __unselectedVfo(self):
+        if self.vfo[self.band] == 'VFOA':
+            return 'VFOB'
+        return 'VFOA'
+
+    def handleFrame(self, frame):
+        # frame without preamble, adresses and end of message
+        key = (self.band, self.vfo[self.band])
+        cmd = frame[0:1]
+        if cmd == b'\x03':
+            return self.__answer(b'\x03' + self.frequency.get(key, bytes(5)))
+        if cmd == b'\x04':
+            return self.__answer(b'\x04' + self.mode.get(key, b'\x01\x01'))
+        if cmd == b'\x05':
+            # like the transceiver MAIN and SUB can not be on the same band
+            other = ('SUB', 'VFOA') if self.band == 'MAIN' else ('MAIN', 'VFOA')
+            if bandOfBcd(bytes(frame[1:6])) == bandOfBcd(self.frequency.get(other, bytes(5))):
+                return self.__answer(b'\xfa')
+            self.frequency[key] = bytes(frame[1:6])
+        elif cmd == b'\x06':
+            self.mode[key] = bytes(frame[1:3])
+        elif cmd == b'\x07' and len(frame) > 1:
+            if frame[1] == 0xd0:
+                self.band = 'MAIN'
+            elif frame[1] == 0xd1:
+                self.band = 'SUB'
+            elif frame[1] == 0xb0:
+                main = [(k, v) for k, v in self.frequency.items() if k[0] == 'MAIN']
+                sub = [(k, v) for k, v in self.frequency.items() if k[0] == 'SUB']
+                self.frequency = dict([(('SUB', k[1]), v) for k, v in main] +
+                                      [(('MAIN', k[1]), v) for k, v in sub])
+            elif frame[1] == 0x00:
+                self.vfo[self.band] = 'VFOA'
+            elif frame[1] == 0x01:
+                self.vfo[self.band] = 'VFOB'
+        elif cmd == b'\x0f' and len(frame) == 1:
+            return self.__answer(b'\x0f' + self.split)
+        elif cmd == b'\x0f' and frame[1] in [0, 1]:
+            self.split = bytes(frame[1:2])
+        elif bytes(frame[0:2]) in self.VFO_SETTINGS and len(frame) == 2:
+            return self.__answer(bytes(frame) + self.vfoSettings.get(key + (bytes(frame[0:2]),),
+                                                                     self.VFO_SETTINGS[bytes(frame[0:2])]))
+        elif bytes(frame[0:2]) in self.VFO_SETTINGS:
+            self.vfoSettings[key + (bytes(frame[0:2]),)] = bytes(frame[2:])
+        elif cmd == b'\x16' and len(frame) == 2:
+            return self.__answer(bytes(frame) + self.settings.get(frame[1], b'\x00'))
+        elif cmd == b'\x16' and len(frame) > 2:
+            self.settings[frame[1]] = bytes(frame[2:3])
+        elif cmd == b'\x1c' and len(frame) == 2:
+            return self.__answer(b'\x1c\x00\x00')  # PTT is always off
+        elif cmd == b'\x25' and len(frame) > 6:
+            self.frequency[(self.band, self.__unselectedVfo())] = bytes(frame[2:7])
+        return self.__answer(b'\xfb')
+
+    def serve(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        b = bytearray()
+        while True:
+            data = conn.recv(1024)
+            if not data:
+                break
+            b.extend(data)
+            while b.count(b'\xfd') > 0:
+                end = b.find(b'\xfd')
+                frame = b[0:end]
+                del b[0:end + 1]
+                # FE FE <to> <from> payload
+                if len(frame) > 4 and frame[0] == 254 and frame[1] == 254 and frame[2] == self.icomTrxCivAdress:
+                    answer = self.handleFrame(frame[4:])
+                    if self.delay > 0:
+                        time.sleep(self.delay)
+                    conn.sendall(answer)
+        conn.close()
+
+    def listen(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(1)
+
+    def run(self):
+        if self.sock is None:
+            self.listen()
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                break
+            print('CI-V loopback connected to:', addr)
+            try:
+                self.serve(conn)
+            except OSError:
+                conn.close()
+
+    def start(self):
+        self.listen()
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+if __name__ == '__main__':
+    port = 4533
+    delay = 0.0
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        delay = float(sys.argv[2]) / 1000
+    print('CI-V loopback radio listening on port', port)
+    LoopbackRadio(port, delay=delay).run()
@@ -39,67 +39,152 @@ Comments: The original script has been adapted for use with the Icom IC-9100. Th
           solution to use Gpredict on a Raspberry Pi to apply doppler tracking to the IC-9100 and
           allowing to set a frequency offset per satellite.
 
+Date    : 10/2026
+Comments: The tracking engine (gpredict server, gqrx and transceiver) runs in its own process.
+          GUI and engine exchange RIT, downlink mode, satellite selection and status through
+          the shared memory block SharedState. Only the engine process talks to the transceiver.
+
 """
 
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 
-import traceback
+import json
+import multiprocessing
+import os
 import socket
 import sys
 import icom
+import satellite
 import time
 import linecache
 
 
-class Satellite:
-    name = ""
-    mode = ""  # SSB, FM, CW
-    satmode = ""  # U/V, V/U, S/U, U/U, V/V
-    rit = 0
-
-
-class WorkerSignals(QObject):
-    finished = pyqtSignal()
-    error = pyqtSignal(tuple)
-    result = pyqtSignal(object)
-    progress = pyqtSignal(int)
-
-
-class Worker(QRunnable):
-
-    def __init__(self, fn, *args, **kwargs):
-        super(Worker, self).__init__()
-
-        # Store constructor arguments (re-used for processing)
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
-        self.signals = WorkerSignals()
-
-        # Add the callback to our kwargs
-        self.kwargs['progress_callback'] = self.signals.progress
-
-    @pyqtSlot()
-    def run(self):
-        """
-        Initialise the runner function with passed args, kwargs.
-        """
-
-        # Retrieve args/kwargs here; and fire processing using them
+class SharedState:
+    # small shared memory block between the gui and the tracking engine process
+    # every value has exactly one writer, so no lock is needed
+
+    STATUS_STARTING = 0
+    STATUS_WAITING = 1  # waiting for gpredict
+    STATUS_CONNECTED = 2  # gpredict is connected
+    STATUS_SETUP = 3  # start sequence for a satellite is send to the transceiver
+
+    def __init__(self, context):
+        # written by the gui
+        self.isRunning = context.RawValue('b', True)
+        self.rit = context.RawValue('i', 0)
+        self.isDownlinkConstant = context.RawValue('b', False)
+        self.satelliteIndex = context.RawValue('i', -1)
+        self.isWarmStart = context.RawValue('b', False)  # verify the transceiver before sending the start sequence
+        self.satelliteSelection = context.RawValue('i', 0)  # incremented after satelliteIndex, rit and isWarmStart are written
+        # written by the tracking engine
+        self.status = context.RawValue('i', SharedState.STATUS_STARTING)
+        self.appliedRit = context.RawValue('i', 0)
+        self.isSetupFailed = context.RawValue('b', False)  # start sequence or warm start check of the last selection failed
+
+
+# rigctl commands: short name -> (long name, number of arguments, label of the value in extended answers)
+RIGCTL_COMMANDS = {'F': ('set_freq', 1, ''), 'f': ('get_freq', 0, 'Frequency'),
+                   'I': ('set_split_freq', 1, ''), 'i': ('get_split_freq', 0, 'TX Frequency'),
+                   'T': ('set_ptt', 1, ''), 't': ('get_ptt', 0, 'PTT'),
+                   'M': ('set_mode', 2, ''), 'S': ('set_split_vfo', 2, ''),
+                   # not handled by gp2icom, known for their arguments: get commands are answered with an error
+                   'V': ('set_vfo', 1, ''), 'v': ('get_vfo', 0, 'VFO'), 'm': ('get_mode', 0, 'Mode'),
+                   's': ('get_split_vfo', 0, 'Split'), 'q': ('quit', 0, '')}
+RIGCTL_UNSUPPORTED = ['v', 'm', 's']
+RIGCTL_LONG_NAMES = dict((value[0], key) for key, value in RIGCTL_COMMANDS.items())
+
+
+# splits a message from gpredict into (command, arguments, separator) tuples. A line can hold
+# several commands, a line starting with + ; | or , asks for extended answers with this separator
+# ('+' is a newline). Unknown commands have no arguments, so the commands after them are not lost.
+def parseRigctl(text):
+    commands = []
+    for line in text.split('\n'):
+        line = line.strip()
+        separator = None
+        if len(line) > 0 and line[0] in '+;|,':
+            separator = '\n' if line[0] == '+' else line[0]
+            line = line[1:]
+        tokens = line.split()
+        while len(tokens) > 0:
+            name = tokens.pop(0)
+            if name.startswith('\\'):
+                name = RIGCTL_LONG_NAMES.get(name[1:], name)
+            count = 0
+            if name in RIGCTL_COMMANDS:
+                count = RIGCTL_COMMANDS[name][1]
+            commands.append((name, tokens[0:count], separator))
+            del tokens[0:count]
+    return commands
+
+
+# answer for one rigctl command, value is None when the command failed
+# the short answers are the same gp2icom always gave gpredict
+def formatRigctl(name, args, value, separator):
+    if separator is None:
+        if value is None:
+            return 'RPRT'
+        if name in ['f', 'i']:
+            return value + '\n'
+        if name == 't':
+            return value
+        return 'RPRT 0'
+    longName, count, label = RIGCTL_COMMANDS.get(name, (name.lstrip('\\'), 0, ''))
+    answer = longName + ':' + ''.join(' ' + arg for arg in args) + separator
+    if value is None:
+        return answer + 'RPRT -1\n'
+    if len(label) > 0:
+        answer = answer + label + ': ' + value + separator
+    return answer + 'RPRT 0\n'
+
+
+class SatelliteStateStore:
+    # last runtime state per satellite (RIT, band assignment, mode) and the last selected satellite,
+    # kept in a small json file, so a restart can continue where it stopped
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.last = ''
+        self.appliedRit = 0  # RIT which is in the downlink frequency of the transceiver
+        self.satellites = {}
         try:
-            result = self.fn(*self.args, **self.kwargs)
-        except:
-            traceback.print_exc()
-            exctype, value = sys.exc_info()[:2]
-            self.signals.error.emit((exctype, value, traceback.format_exc()))
-        else:
-            self.signals.result.emit(result)  # Return the result of the processing
-        finally:
-            self.signals.finished.emit()  # Done
+            with open(filename, 'r') as fp:
+                data = json.load(fp)
+            self.last = data.get('last', '')
+            self.appliedRit = int(data.get('appliedRit', 0))
+            self.satellites = data.get('satellites', {})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    # stored RIT if band assignment and mode of the satellite are unchanged, otherwise None
+    def getRit(self, sat):
+        stored = self.satellites.get(sat.name)
+        if stored is None or stored.get('satmode') != sat.satmode or stored.get('mode') != sat.mode:
+            return None
+        return stored.get('rit')
+
+    def update(self, sat, rit):
+        self.last = sat.name
+        self.satellites[sat.name] = {'rit': rit, 'satmode': sat.satmode, 'mode': sat.mode}
+        self.save()
+
+    def updateAppliedRit(self, rit):
+        self.appliedRit = rit
+        self.save()
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        try:
+            with open(tmp, 'w') as fp:
+                json.dump({'last': self.last, 'appliedRit': self.appliedRit, 'satellites': self.satellites}, fp,
+                          separators=(',', ':'))
+            os.replace(tmp, self.filename)
+        except OSError as e:
+            print('could not save ' + self.filename + ': ' + str(e))
 
 
-class MainWindow(QMainWindow):
+class TrackingEngine:
     HOST = '127.0.0.1'  # Standard loopback interface address (localhost)
     PORT_SERVER = 4532  # Port to listen on (non-privileged ports are > 1023)
     PORT_GQRX_VHF = 7300  # VHF gqrx port 
@@ -112,10 +197,29 @@ class MainWindow(QMainWindow):
     last_rit = 0  # last rit which was set
 
     isSatelliteDuplex = True
-    isDownlinkConstant = False
-    isLoopActive = True
 
-    satellites = []
+    # uplink mode of the start sequence for the mode in satellites.txt
+    UPLINK_MODE_DUPLEX = {'SSB': 'LSB', 'CW': 'CW', 'FM': 'FM'}
+    UPLINK_MODE_SIMPLEX = {'FM': 'FM', 'FM-D': 'FM-D', 'SSB-D': 'SSB-D'}
+    # CI-V mode byte of a mode, data modes are using the same byte
+    MODE_CODE = {'LSB': 0, 'USB': 1, 'CW': 3, 'FM': 5, 'FM-D': 5, 'SSB-D': 1}
+    # data mode byte (1A 06) setMode writes for a mode, CW does not set it
+    DATA_MODE = {'LSB': 0, 'USB': 0, 'FM': 0, 'FM-D': 1, 'SSB-D': 1}
+    TONE = b'\x06\x70'  # 67.0 Hz tone of the FM uplink in bcd
+    BAND_RANGE = {'V': (144000000, 148000000), 'U': (430000000, 450000000), 'L': (1240000000, 1300000000)}
+    SUB_FREQUENCY_MAX_AGE = 1.0  # seconds a cached SUB frequency is used to answer gpredict
+
+    subFrequency = ''  # last known frequency of SUB (downlink + rit), cached radio state
+    subFrequencyTime = 0.0
+
+    def __init__(self, state, satellites, debug):
+        self.state = state
+        self.satellites = satellites
+        self.debug = debug
+        self.satelliteSelection = 0
+        self.status = SharedState.STATUS_STARTING
+        # the downlink on the transceiver still contains the RIT of the last engine or the last session
+        self.last_rit = state.appliedRit.value
 
     #  ####################################################
 
@@ -183,14 +287,46 @@ class MainWindow(QMainWindow):
         icomTrx.setRitFrequence(0)
         icomTrx.setRitOn(False)
 
+    def getUplinkCommands(self, up):
+        return [b'\x07\xd0', b'\x05' + icom.frequenceToBcd(up), b'\x07\xd1']
+
+    def getDownlinkCommands(self, dw):
+        return [b'\x07\xd1', b'\x05' + icom.frequenceToBcd(str(int(dw) + int(self.rit)))]
+
+    # sends CI-V commands as one batch and keeps the cached SUB frequency up to date
+    def executeBatch(self, commands):
+        batch = []
+        for command in commands:
+            # a band which is already selected, is not selected again
+            if not (command[0] == 7 and len(batch) > 0 and batch[-1] == command):
+                batch.append(command)
+        answers = icomTrx.queryBatch(batch)
+        band = ''
+        for command, answer in zip(batch, answers):
+            if command == b'\x07\xd0':
+                band = 'MAIN'
+            elif command == b'\x07\xd1':
+                band = 'SUB'
+            elif band == 'SUB' and command[0] == 5 and answer == b'\xfb':
+                self.setSubFrequency(icom.frequenceFromBcd(command[1:6]))
+            elif band == 'SUB' and command[0] == 3 and len(answer) == 6 and answer[0] == 3:
+                self.setSubFrequency(icom.frequenceFromBcd(answer[1:6]))
+        # frequencies the icom send before our commands are outdated
+        icomTrx.pollTransceiveFrequence()
+        return answers
+
+    def setSubFrequency(self, freq):
+        self.subFrequency = freq
+        self.subFrequencyTime = time.time()
+
+    def isSubFrequencyFresh(self):
+        return len(self.subFrequency) > 0 and time.time() - self.subFrequencyTime < self.SUB_FREQUENCY_MAX_AGE
+
     def setUplink(self, up):
-        icomTrx.setVFO('MAIN')
-        icomTrx.setFrequence(up)
-        icomTrx.setVFO('SUB')
+        self.executeBatch(self.getUplinkCommands(up))
 
     def setDownlink(self, dw):
-        icomTrx.setVFO('SUB')
-        icomTrx.setFrequence(str(int(dw) + int(self.rit)))
+        self.executeBatch(self.getDownlinkCommands(dw))
 
     def setUplinkSimplex(self, up):
         if icomTrx.isPttOff():
@@ -207,123 +343,127 @@ class MainWindow(QMainWindow):
             icomTrx.setVFO('VFOA')
             icomTrx.setFrequence(str(int(dw) + int(self.rit)))
 
-    def __init__(self, *args, **kwargs):
-        super(MainWindow, self).__init__(*args, **kwargs)
-
-        try:
-            with open('satellites.txt', 'r') as fp:
-                for line in fp:
-                    new_satellite = Satellite()
-                    new_satellite.name = line.split(",")[0] + " " + line.split(",")[1]
-                    new_satellite.mode = line.split(",")[1]
-                    new_satellite.rit = line.split(",")[2]
-                    new_satellite.satmode = line.split(",")[3].replace("\n", "").upper()
-                    self.satellites.append(new_satellite)
-        finally:
-            fp.close()
-
-        layout = QGridLayout()
-
-        comboSatellite = QComboBox(self)
-        for sat in self.satellites:
-            comboSatellite.addItem(sat.name)
-        comboSatellite.currentTextChanged.connect(self.on_combobox_changed)
-
-        buttonRitUp = QPushButton("RIT +25Hz")
-        buttonRitUp.pressed.connect(self.setRitUp)
-
-        buttonRitDown = QPushButton("RIT -25Hz")
-        buttonRitDown.pressed.connect(self.setRitDown)
-
-        self.ritLabel = QLabel(self)
-
-        layout.addWidget(comboSatellite, 0, 0)
-
-        layout.addWidget(buttonRitUp, 1, 0)
-        layout.addWidget(buttonRitDown, 1, 1)
-        layout.addWidget(self.ritLabel, 1, 2)
-
-        radiobutton = QRadioButton('Sat constant')
-        radiobutton.setChecked(True)
-        radiobutton.country = 'Sat constant'
-        radiobutton.setToolTip('Frequency on satellite transponder will be held constant')
-        radiobutton.toggled.connect(self.onRadioButtonSatelliteConstantClicked)
-        layout.addWidget(radiobutton, 4, 0)
-
-        radiobutton = QRadioButton('Downlink constant')
-        radiobutton.setChecked(False)
-        radiobutton.country = 'Downlink constant'
-        radiobutton.setToolTip('Frequency on the downlink will be held constant')
-        radiobutton.toggled.connect(self.onRadioButtonDownlinkConstantClicked)
-        layout.addWidget(radiobutton, 4, 1)
-
-        w = QWidget()
-        w.setLayout(layout)
-
-        self.setWindowTitle('Gpredict with IC-9100/9700')
-        self.setCentralWidget(w)
-        self.show()
-
-        self.threadpool = QThreadPool()
-
-        worker = Worker(self.execute_main_loop)  # Any other args, kwargs are passed to the run function
-        # Execute
-        self.threadpool.start(worker)
+    def setStatus(self, status):
+        self.status = status
+        self.state.status.value = status
+
+    # a new satellite selection from the gui is applied between two gpredict commands
+    def applySatelliteSelection(self):
+        selection = self.state.satelliteSelection.value
+        if selection != self.satelliteSelection:
+            self.satelliteSelection = selection
+            status = self.status
+            self.setStatus(SharedState.STATUS_SETUP)
+            try:
+                self.selectSatellite(self.satellites[self.state.satelliteIndex.value], self.state.isWarmStart.value)
+                self.state.isSetupFailed.value = False
+            except Exception as e:
+                # keep the engine running, the gui shows the failure and a new selection tries again
+                print('EXCEPTION IN SATELLITE SETUP: {}'.format(repr(e)))
+                self.state.isSetupFailed.value = True
+            self.setStatus(status)
+        self.rit = self.state.rit.value
+
+    def selectSatellite(self, sat, isWarmStart):
+        self.subFrequency = ''
+
+        satModeArray = sat.satmode.split('/')
+        if satModeArray[0] != satModeArray[1]:
+            self.isSatelliteDuplex = True
+            uplinkMode = self.UPLINK_MODE_DUPLEX.get(sat.mode)
+        else:
+            self.isSatelliteDuplex = False
+            uplinkMode = self.UPLINK_MODE_SIMPLEX.get(sat.mode)
 
-    def onRadioButtonDownlinkConstantClicked(self):
-        self.isDownlinkConstant = True
+        # warm start: when the transceiver is already set up for this satellite, the start sequence
+        # is not needed. The downlink still contains last_rit, a different RIT of this satellite is
+        # send with the next gpredict command.
+        if isWarmStart and uplinkMode is not None and self.isTransceiverReady(satModeArray, uplinkMode):
+            return
 
-    def onRadioButtonSatelliteConstantClicked(self):
-        self.isDownlinkConstant = False
+        icomTrx.setSatelliteMode(False)
+        icomTrx.setDualWatch(True)
 
-    def on_combobox_changed(self, value):
-        for sat in self.satellites:
-            if sat.name == value:
-                self.isLoopActive = False
-                time.sleep(0.5)
-
-                icomTrx.setSatelliteMode(False)
-                icomTrx.setDualWatch(True)
-
-                # set correct bands in SUB and MAIN für U/U, U/V, etc
-                satModeArray = sat.satmode.split('/')
-                self.activateCorrectUplinkBandInMain(satModeArray[0])
-                if satModeArray[0] != satModeArray[1]:
-                    self.isSatelliteDuplex = True
-                else:
-                    self.isSatelliteDuplex = False
-
-                self.rit = int(sat.rit)
-
-                if self.isSatelliteDuplex:
-                    if sat.mode == 'SSB':
-                        self.setStartSequenceSatellite('LSB')
-                    if sat.mode == 'CW':
-                        self.setStartSequenceSatellite('CW')
-                    if sat.mode == 'FM':
-                        self.setStartSequenceSatellite('FM')
-                else:
-                    if sat.mode == 'FM':
-                        self.setStartSequenceSimplex('FM')
-                    if sat.mode == 'FM-D':
-                        self.setStartSequenceSimplex('FM-D')
-                    if sat.mode == 'SSB-D':
-                        self.setStartSequenceSimplex('SSB-D')
-
-                self.isLoopActive = True
-                break
+        # set correct bands in SUB and MAIN für U/U, U/V, etc
+        self.activateCorrectUplinkBandInMain(satModeArray[0])
 
-    def execute_main_loop(self, progress_callback):
+        if uplinkMode is not None:
+            if self.isSatelliteDuplex:
+                self.setStartSequenceSatellite(uplinkMode)
+            else:
+                self.setStartSequenceSimplex(uplinkMode)
+
+    def getBand(self, freq):
+        for band, (low, high) in self.BAND_RANGE.items():
+            if low <= freq <= high:
+                return band
+        return ''
+
+    # proofs the answers of a frequency (03) and a mode (04) query against band and mode
+    def isBandAndMode(self, freqAnswer, modeAnswer, band, mode):
+        if len(freqAnswer) < 6 or freqAnswer[0] != 3 or len(modeAnswer) < 2 or modeAnswer[0] != 4:
+            return False
+        freq = icom.frequenceFromBcd(freqAnswer[1:6])
+        if len(freq) == 0 or self.getBand(int(freq)) != band:
+            return False
+        return modeAnswer[1] == self.MODE_CODE.get(mode)
+
+    # queries for the selected VFO: frequency, mode, data mode and the tone (on or off, None when the
+    # start sequence does not set it) with the tone frequency when it is on
+    def getVfoQueries(self, tone):
+        queries = [b'\x03', b'\x04', b'\x1a\x06']
+        if tone is not None:
+            queries.append(b'\x16\x42')
+        if tone:
+            queries.append(b'\x1b\x00')
+        return queries
+
+    # proofs the answers of getVfoQueries against the start sequence
+    def isVfoReady(self, answers, band, mode, tone):
+        if not self.isBandAndMode(answers[0], answers[1], band, mode):
+            return False
+        if mode in self.DATA_MODE and answers[2][0:3] != bytes([26, 6, self.DATA_MODE[mode]]):
+            return False
+        if tone is not None and answers[3] != bytes([22, 66, int(tone)]):
+            return False
+        return not tone or (answers[4][0:2] == b'\x1b\x00' and answers[4].endswith(self.TONE))
+
+    # verifies the transceiver with one batch of queries instead of sending the start sequence
+    def isTransceiverReady(self, satModeArray, uplinkMode):
+        if self.isSatelliteDuplex:
+            if uplinkMode == 'FM':
+                downlinkMode = 'FM'
+                uplinkTone, downlinkTone = True, False  # 67 Hz tone on the uplink only
+            else:
+                downlinkMode = 'USB'
+                uplinkTone, downlinkTone = None, None
+            uplinkQueries = self.getVfoQueries(uplinkTone)
+            answers = icomTrx.queryBatch([b'\x16\x5a', b'\x16\x59', b'\x0f', b'\x07\xd0'] + uplinkQueries
+                                         + [b'\x07\xd1'] + self.getVfoQueries(downlinkTone))
+            uplinkAnswers = answers[4:4 + len(uplinkQueries)]
+            downlinkAnswers = answers[5 + len(uplinkQueries):]
+            return (answers[0] == b'\x16\x5a\x00' and answers[1] == b'\x16\x59\x01' and answers[2] == b'\x0f\x00'
+                    and self.isVfoReady(uplinkAnswers, satModeArray[0], uplinkMode, uplinkTone)
+                    and self.isVfoReady(downlinkAnswers, satModeArray[1], downlinkMode, downlinkTone))
+        else:
+            # uplink on VFOB, downlink on VFOA, VFOA is selected at the end like after the start sequence
+            queries = self.getVfoQueries(False)
+            answers = icomTrx.queryBatch([b'\x16\x5a', b'\x16\x59', b'\x0f', b'\x07\xd0', b'\x07\x01'] + queries
+                                         + [b'\x07\x00'] + queries)
+            uplinkAnswers = answers[5:5 + len(queries)]
+            downlinkAnswers = answers[6 + len(queries):]
+            return (answers[0] == b'\x16\x5a\x00' and answers[1] == b'\x16\x59\x01' and answers[2] == b'\x0f\x01'
+                    and self.isVfoReady(uplinkAnswers, satModeArray[0], uplinkMode, False)
+                    and self.isVfoReady(downlinkAnswers, satModeArray[1], uplinkMode, False))
+
+    def execute_main_loop(self):
         uplink = '0'
         downlink = '0'
         last_uplink = '0'
         last_downlink = '0'
         actual_sub_frequency = ''
 
-        debug = False
-        if len(sys.argv) > 1:
-            if sys.argv[1].upper() == '-DEBUG':
-                debug = True
+        debug = self.debug
 
         ###############################################
         # start socket for gpredict
@@ -331,8 +471,10 @@ class MainWindow(QMainWindow):
 
         # start tcp server
         sock_gpredict = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock_gpredict.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # fast restart of the engine
         sock_gpredict.bind((self.HOST, self.PORT_SERVER))
         sock_gpredict.listen(1)
+        sock_gpredict.settimeout(0.2)  # wake up for satellite selections and shutdown from the gui
 
         ###############################################
         # create and open sockets for gqrx VHF, UHF, and SHF
@@ -361,151 +503,376 @@ class MainWindow(QMainWindow):
         # main loop
         ###############################################
 
-        while True:
-            conn, addr = sock_gpredict.accept()
+        self.setStatus(SharedState.STATUS_WAITING)
+        while self.state.isRunning.value:
+            self.applySatelliteSelection()
+            try:
+                conn, addr = sock_gpredict.accept()
+            except socket.timeout:
+                continue
             print('Connected to Gpredict at:', addr)
-            while 1:
-                if self.isLoopActive:
-                    try:
-                        data = conn.recv(1000)
+            self.setStatus(SharedState.STATUS_CONNECTED)
+            conn.settimeout(0.2)
+            while self.state.isRunning.value:
+                self.applySatelliteSelection()
+                try:
+                    data = conn.recv(1000)
+                    if debug:
+                        print('\n###### LOOP START')
+                        print('> gpredict: ' + data.decode('utf-8').replace('\n', ''))
+                        print('> icom:', icomTrx.getWhatFrequencyIcomSendUs())
+                    if not data:
+                        break
+                    civCommands = []
+                    if self.rit != self.last_rit:
+                        # get the rig's downlink frequency, subtract old RIT, add new RIT and send that to the radio
+                        if self.isSatelliteDuplex:
+                            # the SUB frequency is cached, the radio is only asked when the cache is too old,
+                            # the new downlink goes with the CI-V batch of this gpredict command
+                            transceiveFrequency = icomTrx.pollTransceiveFrequence()
+                            if len(transceiveFrequency) > 0:
+                                self.setSubFrequency(transceiveFrequency)
+                            if not self.isSubFrequencyFresh():
+                                self.executeBatch([b'\x07\xd1', b'\x03'])
+                            actual_sub_frequency = self.subFrequency
+                        else:
+                            icomTrx.setVFO('MAIN')
+                            icomTrx.setVFO('VFOA')
+                            actual_sub_frequency = icomTrx.getFrequence()
+                        actual_downlink_frequency = str(int(actual_sub_frequency) - int(self.last_rit))
+                        if self.isSatelliteDuplex:
+                            civCommands += self.getDownlinkCommands(actual_downlink_frequency)
+                        else:
+                            TrackingEngine.setDownlinkSimplex(self, actual_downlink_frequency)
+                        # gqrx part
+                        b = bytearray()
+                        b.extend(map(ord, 'F ' + str(int(actual_downlink_frequency) + int(self.rit)) + '\n'))
+                        if actual_downlink_frequency[1] == '4' and port_vhf_open == 0:
+                            sock_gqrx_vhf.sendall(b)
+                        elif actual_downlink_frequency[1] == '3' and port_uhf_open == 0:
+                            sock_gqrx_uhf.sendall(b)
+                        elif actual_downlink_frequency[1] == '2' and port_shf_open == 0:
+                            sock_gqrx_shf.sendall(b)
+                        self.last_rit = self.rit
+                        self.state.appliedRit.value = self.rit
+                    # a message can hold several rigctl commands: all set commands are send to the icom
+                    # as one CI-V batch, after that the queries are answered from the cached radio state
+                    commands = parseRigctl(data.decode('utf-8'))
+                    names = [command[0] for command in commands]
+                    if 'F' in names or 'I' in names:
+                        # get downlink and uplink from gpredict
+                        # and set downlink and uplink to icom
+                        for name, args, separator in commands:
+                            if name == 'F' and len(args) > 0:  # F - gpredict want to set Downlink
+                                if self.state.isDownlinkConstant.value:
+                                    downlink = last_downlink
+                                else:
+                                    downlink = args[0]
+                            if name == 'I' and len(args) > 0:  # I - gpredict want to set Uplink
+                                uplink = args[0]
                         if debug:
-                            print('\n###### LOOP START')
-                            print('> gpredict: ' + data.decode('utf-8').replace('\n', ''))
-                            print('> icom:', icomTrx.getWhatFrequencyIcomSendUs())
-                        if not data:
-                            break
-                        if self.rit != self.last_rit:
+                            print('>> gp2icom: last  ^ ' + last_uplink + ' v ' + last_downlink)
+                            print('>> gp2icom: fresh ^ ' + uplink + ' v ' + downlink)
+                        # only if uplink or downlink changed > 0 10Hz Column, then update
+                        if (abs(int(last_uplink) - int(uplink)) > self.FREQUENCY_OFFSET_UPLINK):
                             if self.isSatelliteDuplex:
-                                icomTrx.setVFO('SUB')
+                                civCommands += self.getUplinkCommands(uplink)
                             else:
-                                icomTrx.setVFO('MAIN')
-                                icomTrx.setVFO('VFOA')
-                            # get the rig's downlink frequency, subtract old RIT, add new RIT and send that to the radio
-                            actual_sub_frequency = icomTrx.getFrequence()
-                            actual_downlink_frequency = str(int(actual_sub_frequency) - int(self.last_rit))
+                                TrackingEngine.setUplinkSimplex(self, uplink)
+                            last_uplink = uplink
+                            # # gqrx part
                             if self.isSatelliteDuplex:
-                                MainWindow.setDownlink(self, actual_downlink_frequency)
-                            else:
-                                MainWindow.setDownlinkSimplex(self, actual_downlink_frequency)
-                            # gqrx part
-                            b = bytearray()
-                            b.extend(map(ord, 'F ' + str(int(actual_downlink_frequency) + int(self.rit)) + '\n'))
-                            if actual_downlink_frequency[1] == '4' and port_vhf_open == 0:
-                                sock_gqrx_vhf.sendall(b)
-                            elif actual_downlink_frequency[1] == '3' and port_uhf_open == 0:
-                                sock_gqrx_uhf.sendall(b)
-                            elif actual_downlink_frequency[1] == '2' and port_shf_open == 0:
-                                sock_gqrx_shf.sendall(b)
-                            self.last_rit = self.rit
-                            self.ritLabel.setText(str(self.rit))
-                        if data[0] in [70, 73]:  # I, F
-                            # get downlink and uplink from gpredict
-                            # and set downlink and uplink to icom
-                            cut = data.decode('utf-8').split(' ')
-                            if data[0] == 70:  # F - gpredict want to set Downlink
-                                if self.isDownlinkConstant:
-                                    downlink = last_downlink
-                                else:
-                                    downlink = cut[len(cut) - 1].replace('\n', '')
-                            if data[0] == 73:  # I - gpredict want to set Uplink
-                                uplink = cut[len(cut) - 1].replace('\n', '')
-                            if debug:
-                                print('>> gp2icom: last  ^ ' + last_uplink + ' v ' + last_downlink)
-                                print('>> gp2icom: fresh ^ ' + uplink + ' v ' + downlink)
-                            # only if uplink or downlink changed > 0 10Hz Column, then update
-                            if (abs(int(last_uplink) - int(uplink)) > self.FREQUENCY_OFFSET_UPLINK):
+                                b = bytearray()
+                                b.extend(map(ord, 'F ' + uplink + '\n'))
+                                if uplink[1] == '4' and port_vhf_open == 0:
+                                    sock_gqrx_vhf.sendall(b)
+                                elif uplink[1] == '3' and port_uhf_open == 0:
+                                    sock_gqrx_uhf.sendall(b)
+                                elif uplink[1] == '2' and port_shf_open == 0:
+                                    sock_gqrx_shf.sendall(b)
+                        if not self.state.isDownlinkConstant.value:
+                            if (abs(int(last_downlink) - int(downlink)) > self.FREQUENCY_OFFSET_DOWNLINK):
                                 if self.isSatelliteDuplex:
-                                    MainWindow.setUplink(self, uplink)
+                                    civCommands += self.getDownlinkCommands(downlink)
                                 else:
-                                    MainWindow.setUplinkSimplex(self, uplink)
-                                last_uplink = uplink
-                                # # gqrx part
-                                if self.isSatelliteDuplex:
-                                    b = bytearray()
-                                    b.extend(map(ord, 'F ' + uplink + '\n'))
-                                    if uplink[1] == '4' and port_vhf_open == 0:
-                                        sock_gqrx_vhf.sendall(b)
-                                    elif uplink[1] == '3' and port_uhf_open == 0:
-                                        sock_gqrx_uhf.sendall(b)
-                                    elif uplink[1] == '2' and port_shf_open == 0:
-                                        sock_gqrx_shf.sendall(b)
-                            if not self.isDownlinkConstant:
-                                if (abs(int(last_downlink) - int(downlink)) > self.FREQUENCY_OFFSET_DOWNLINK):
-                                    if self.isSatelliteDuplex:
-                                        MainWindow.setDownlink(self, downlink)
-                                    else:
-                                        MainWindow.setDownlinkSimplex(self, downlink)
-                                    # gqrx part
-                                    b = bytearray()
-                                    b.extend(map(ord, 'F ' + str(int(downlink) + int(self.rit)) + '\n'))
-                                    if downlink[1] == '4' and port_vhf_open == 0:
-                                        sock_gqrx_vhf.sendall(b)
-                                    elif downlink[1] == '3' and port_uhf_open == 0:
-                                        sock_gqrx_uhf.sendall(b)
-                                    elif downlink[1] == '2' and port_shf_open == 0:
-                                        sock_gqrx_shf.sendall(b)
-                                    last_downlink = downlink
-                            conn.send(b'RPRT 0')  # Return Data OK to gpredict
-                        elif data[0] in [102, 105]:  # i, f
-                            # read downlink or uplink from icom
-                            # and send it to gpredict
-                            if not self.isSatelliteDuplex:
-                                conn.send(b'RPRT')
+                                    TrackingEngine.setDownlinkSimplex(self, downlink)
+                                # gqrx part
+                                b = bytearray()
+                                b.extend(map(ord, 'F ' + str(int(downlink) + int(self.rit)) + '\n'))
+                                if downlink[1] == '4' and port_vhf_open == 0:
+                                    sock_gqrx_vhf.sendall(b)
+                                elif downlink[1] == '3' and port_uhf_open == 0:
+                                    sock_gqrx_uhf.sendall(b)
+                                elif downlink[1] == '2' and port_shf_open == 0:
+                                    sock_gqrx_shf.sendall(b)
+                                last_downlink = downlink
+                    if 'f' in names and self.isSatelliteDuplex:
+                        # the user may dail the SUB, CI-V TRANSCEIVE tells us without asking
+                        transceiveFrequency = icomTrx.pollTransceiveFrequence()
+                        if len(transceiveFrequency) > 0:
+                            self.setSubFrequency(transceiveFrequency)
+                        if not self.isSubFrequencyFresh():
+                            civCommands += [b'\x07\xd1', b'\x03']  # ask SUB for the downlink
+                    if len(civCommands) > 0:
+                        self.executeBatch(civCommands)
+
+                    replies = []
+                    for name, args, separator in commands:
+                        value = ''
+                        if name == 'q':  # q - gpredict closes the session, like rigctld there is no answer
+                            continue
+                        if name in RIGCTL_UNSUPPORTED:
+                            value = None
+                        elif name in ['f', 'i'] and not self.isSatelliteDuplex:
+                            value = None
+                        elif name == 'f':  # f - gpredict ask for downlink
+                            if debug:
+                                print('>> gpredict: ask for downlink')
+                            actual_sub_frequency = self.subFrequency
+                            if len(actual_sub_frequency) > 0 and actual_sub_frequency[0:2] in ['14', '43', '12']:
+                                downlink = str(int(actual_sub_frequency) - int(self.rit))
+                                value = downlink
+                                b = bytearray()
+                                b.extend(map(ord, 'F ' + str(int(downlink) + int(self.rit)) + '\n'))
+                                if downlink[1] == '4' and port_vhf_open == 0:
+                                    sock_gqrx_vhf.sendall(b)
+                                elif downlink[1] == '3' and port_uhf_open == 0:
+                                    sock_gqrx_uhf.sendall(b)
+                                elif downlink[1] == '2' and port_shf_open == 0:
+                                    sock_gqrx_shf.sendall(b)
                             else:
-                                if data[0] == 102:  # f - gpredict ask for downlink
-                                    if debug:
-                                        print('>> gpredict: ask for downlink')
-                                    actual_sub_frequency = icomTrx.getFrequence()
-                                    if len(actual_sub_frequency) > 0 and actual_sub_frequency[0:2] in ['14', '43', '12']:
-                                        downlink = str(int(actual_sub_frequency) - int(self.rit))
-                                        b = bytearray()
-                                        b.extend(map(ord, str(int(actual_sub_frequency) - int(self.rit)) + '\n'))
-                                        conn.send(b)
-                                        b = bytearray()
-                                        b.extend(map(ord, 'F ' + str(int(downlink) + int(self.rit)) + '\n'))
-                                        if downlink[1] == '4' and port_vhf_open == 0:
-                                            sock_gqrx_vhf.sendall(b)
-                                        elif downlink[1] == '3' and port_uhf_open == 0:
-                                            sock_gqrx_uhf.sendall(b)
-                                        elif downlink[1] == '2' and port_shf_open == 0:
-                                            sock_gqrx_shf.sendall(b)
-                                    else:
-                                        conn.send(b'RPRT')
-                                elif data[0] == 105:  # i - gpredict ask for uplink
-                                    b = bytearray()
-                                    b.extend(map(ord, uplink + '\n'))
-                                    conn.send(b)
-                        elif data[0] == 116:  # t ptt
-                            conn.send(b'0')
-                        else:
-                            conn.send(b'RPRT 0')  # Return Data OK to gpredict
-                    except Exception as e:
-                        print('SUB FREQUENCY: ' + actual_sub_frequency)
-                        print('DOWNLINK: ' + downlink)
-                        exc_type, exc_obj, tb = sys.exc_info()
-                        f = tb.tb_frame
-                        lineno = tb.tb_lineno
-                        filename = f.f_code.co_filename
-                        linecache.checkcache(filename)
-                        line = linecache.getline(filename, lineno, f.f_globals)
-                        print('EXCEPTION IN ({}, LINE {} "{}"): {}'.format(filename, lineno, line.strip(), exc_obj))
-                        print('connection maybe corrupt or failure in loop: close connection')
-                        conn.close()
+                                value = None
+                        elif name == 'i':  # i - gpredict ask for uplink
+                            value = uplink
+                        elif name == 't':  # t ptt
+                            value = '0'
+                        replies.append(formatRigctl(name, args, value, separator))
+                    if 'q' in names:
+                        if len(replies) > 0:
+                            conn.send(''.join(reply if reply.endswith('\n') else reply + '\n'
+                                              for reply in replies).encode('utf-8'))
                         break
+                    if len(replies) == 0:
+                        conn.send(b'RPRT 0')  # Return Data OK to gpredict
+                    elif len(replies) == 1:
+                        conn.send(replies[0].encode('utf-8'))
+                    else:
+                        # one aggregated answer, every single answer ends with a newline
+                        conn.send(''.join(reply if reply.endswith('\n') else reply + '\n'
+                                          for reply in replies).encode('utf-8'))
+                except socket.timeout:
+                    continue
+                except Exception as e:
+                    print('SUB FREQUENCY: ' + actual_sub_frequency)
+                    print('DOWNLINK: ' + downlink)
+                    exc_type, exc_obj, tb = sys.exc_info()
+                    f = tb.tb_frame
+                    lineno = tb.tb_lineno
+                    filename = f.f_code.co_filename
+                    linecache.checkcache(filename)
+                    line = linecache.getline(filename, lineno, f.f_globals)
+                    print('EXCEPTION IN ({}, LINE {} "{}"): {}'.format(filename, lineno, line.strip(), exc_obj))
+                    print('connection maybe corrupt or failure in loop: close connection')
+                    conn.close()
+                    break
             conn.close()
             print('Connection to Gpredict closed.')
+            self.setStatus(SharedState.STATUS_WAITING)
+        sock_gpredict.close()
+
+
+def runTrackingEngine(state, satellites, debug):
+    # entry point of the tracking engine process, the transceiver is only used from this process
+    global icomTrx
+    icomTrx = icom.icom(*ICOM_TRX)
+    try:
+        TrackingEngine(state, satellites, debug).execute_main_loop()
+    finally:
+        print('CI-V round trips:', icomTrx.getTransportStatistics())
+        icomTrx.close()
+
+
+class MainWindow(QMainWindow):
+    STATE_FILE = 'gp2icom_state.json'  # last RIT per satellite and last selected satellite
+
+    # a stopped tracking engine is restarted at once, then after 1, 2, 4, 8 seconds, the count starts
+    # again when the engine was running for ENGINE_STABLE_TIME before it stopped
+    ENGINE_RESTART_DELAY = 1.0
+    MAX_ENGINE_RESTARTS = 5
+    ENGINE_STABLE_TIME = 60.0
+    engineRestarts = 0
+    engineStartTime = 0.0
+    engineRestartTime = None  # time of the next restart
+    isEngineStopped = False  # the stop of the engine is handled, a restart is planned or given up
+
+    satellites = []
+    satellite = None  # selected satellite
+
+    STATUS_TEXT = {SharedState.STATUS_STARTING: 'starting',
+                   SharedState.STATUS_WAITING: 'waiting for gpredict',
+                   SharedState.STATUS_CONNECTED: 'gpredict connected',
+                   SharedState.STATUS_SETUP: 'setting up satellite'}
+
+    def __init__(self, *args, **kwargs):
+        super(MainWindow, self).__init__(*args, **kwargs)
+
+        self.satellites = satellite.readSatellites('satellites.txt')
+
+        layout = QGridLayout()
+
+        comboSatellite = QComboBox(self)
+        for sat in self.satellites:
+            comboSatellite.addItem(sat.name)
+        comboSatellite.currentTextChanged.connect(self.on_combobox_changed)
+
+        self.store = SatelliteStateStore(self.STATE_FILE)
+
+        buttonRitUp = QPushButton("RIT +25Hz")
+        buttonRitUp.pressed.connect(self.setRitUp)
+
+        buttonRitDown = QPushButton("RIT -25Hz")
+        buttonRitDown.pressed.connect(self.setRitDown)
+
+        self.ritLabel = QLabel(self)
+
+        layout.addWidget(comboSatellite, 0, 0)
+
+        layout.addWidget(buttonRitUp, 1, 0)
+        layout.addWidget(buttonRitDown, 1, 1)
+        layout.addWidget(self.ritLabel, 1, 2)
+
+        radiobutton = QRadioButton('Sat constant')
+        radiobutton.setChecked(True)
+        radiobutton.country = 'Sat constant'
+        radiobutton.setToolTip('Frequency on satellite transponder will be held constant')
+        radiobutton.toggled.connect(self.onRadioButtonSatelliteConstantClicked)
+        layout.addWidget(radiobutton, 4, 0)
+
+        radiobutton = QRadioButton('Downlink constant')
+        radiobutton.setChecked(False)
+        radiobutton.country = 'Downlink constant'
+        radiobutton.setToolTip('Frequency on the downlink will be held constant')
+        radiobutton.toggled.connect(self.onRadioButtonDownlinkConstantClicked)
+        layout.addWidget(radiobutton, 4, 1)
+
+        w = QWidget()
+        w.setLayout(layout)
+
+        self.setWindowTitle('Gpredict with IC-9100/9700')
+        self.setCentralWidget(w)
+        self.show()
+
+        self.debug = False
+        if len(sys.argv) > 1:
+            if sys.argv[1].upper() == '-DEBUG':
+                self.debug = True
+
+        # the tracking engine runs in its own process, so tuning is not disturbed by the gui
+        self.context = multiprocessing.get_context('spawn')
+        self.state = SharedState(self.context)
+        self.state.appliedRit.value = self.store.appliedRit
+        self.startEngine()
+
+        # warm restart with the satellite of the last session
+        for sat in self.satellites:
+            if sat.name == self.store.last:
+                comboSatellite.blockSignals(True)
+                comboSatellite.setCurrentText(sat.name)
+                comboSatellite.blockSignals(False)
+                self.on_combobox_changed(sat.name)
+                break
+
+        self.statusTimer = QTimer(self)
+        self.statusTimer.timeout.connect(self.updateStatus)
+        self.statusTimer.start(250)
+
+    def startEngine(self):
+        self.engineStartTime = time.time()
+        self.isEngineStopped = False
+        self.engine = self.context.Process(target=runTrackingEngine,
+                                           args=(self.state, self.satellites, self.debug), daemon=True)
+        self.engine.start()
+
+    def updateStatus(self):
+        text = self.STATUS_TEXT.get(self.state.status.value, '')
+        if not self.engine.is_alive():
+            if not self.isEngineStopped:
+                # restart with a growing delay, also when it stopped while starting (like a serial port
+                # which is not back after a usb reset)
+                self.isEngineStopped = True
+                if time.time() - self.engineStartTime > self.ENGINE_STABLE_TIME:
+                    self.engineRestarts = 0
+                if self.engineRestarts < self.MAX_ENGINE_RESTARTS:
+                    delay = 0.0
+                    if self.engineRestarts > 0:
+                        delay = self.ENGINE_RESTART_DELAY * 2 ** (self.engineRestarts - 1)
+                    self.engineRestartTime = time.time() + delay
+                    self.engineRestarts += 1
+                    print('tracking engine stopped: restart ' + str(self.engineRestarts))
+            if self.engineRestartTime is None:
+                text = 'tracking engine stopped'
+            elif time.time() >= self.engineRestartTime:
+                # verify the selected satellite instead of sending the start sequence again
+                self.engineRestartTime = None
+                self.state.status.value = SharedState.STATUS_STARTING
+                self.state.isWarmStart.value = True
+                self.startEngine()
+            else:
+                text = 'tracking engine stopped, restart in %d s' % (int(self.engineRestartTime - time.time()) + 1)
+        elif self.state.isSetupFailed.value:
+            text = text + ', satellite setup failed'
+        if self.state.appliedRit.value != self.store.appliedRit:
+            self.store.updateAppliedRit(self.state.appliedRit.value)
+        self.statusBar().showMessage(text + ', RIT on transceiver: ' + str(self.state.appliedRit.value) + ' Hz')
+
+    def closeEvent(self, event):
+        self.statusTimer.stop()
+        self.state.isRunning.value = False
+        self.engine.join(2)
+        if self.engine.is_alive():
+            self.engine.terminate()
+        super(MainWindow, self).closeEvent(event)
+
+    def onRadioButtonDownlinkConstantClicked(self):
+        self.state.isDownlinkConstant.value = True
+
+    def onRadioButtonSatelliteConstantClicked(self):
+        self.state.isDownlinkConstant.value = False
+
+    def on_combobox_changed(self, value):
+        for index, sat in enumerate(self.satellites):
+            if sat.name == value:
+                # a stored RIT means this satellite was already set up once, so the engine can verify
+                # the transceiver instead of sending the whole start sequence
+                rit = self.store.getRit(sat)
+                self.state.isWarmStart.value = rit is not None
+                if rit is None:
+                    rit = int(sat.rit)
+                self.state.rit.value = rit
+                self.state.satelliteIndex.value = index
+                self.state.satelliteSelection.value += 1
+                self.ritLabel.setText(str(self.state.rit.value))
+                self.satellite = sat
+                self.store.update(sat, rit)
+                break
 
     def setRitUp(self):
-        self.rit += 25
-        self.ritLabel.setText(str(self.rit))
+        self.state.rit.value += 25
+        self.ritLabel.setText(str(self.state.rit.value))
+        if self.satellite is not None:
+            self.store.update(self.satellite, self.state.rit.value)
 
     def setRitDown(self):
-        self.rit -= 25
-        self.ritLabel.setText(str(self.rit))
+        self.state.rit.value -= 25
+        self.ritLabel.setText(str(self.state.rit.value))
+        if self.satellite is not None:
+            self.store.update(self.satellite, self.state.rit.value)
+
 
+# serial port like '/dev/ic9700a' or 'COM5', or 'tcp://host:port' for a remote ser2net-like serial server
+ICOM_TRX = ('/dev/ic9700a', '115200', 162)
 
-icomTrx = icom.icom('/dev/ic9700a', '115200', 162)
-app = QApplication([])
-window = MainWindow()
-app.exec_()
-icomTrx.close()
+if __name__ == '__main__':
+    app = QApplication([])
+    window = MainWindow()
+    app.exec_()
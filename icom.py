@@ -13,59 +13,351 @@ Date    : 11/2020
 Comments: to bring ic9100 and ic9700 together in one class the CI-V adress has to be given
           162 - default for IC9700 (162 = hex A2)
           124 - default for IC9100 (124 = hex 7C)
+
+Date    : 10/2026
+Comments: the CI-V bytes are carried by a transport. serialTransport is the usb/serial port,
+          tcpTransport is a raw CI-V stream from a ser2net-like serial server. Give the serialDevice
+          as 'tcp://host:port' to use the tcp transport.
+          Answers are read frame by frame (FE FE 00 <trx> ... FD) until the read timeout of the
+          transport, 0.1 s for serial and 0.5 s for tcp ('tcp://host:port?timeout=0.8' to change it).
 """
 
+import errno
+import os
+import select
 import serial
+import socket
 import time
 
 
+class transport:
+    # base class for CI-V transports, collects round trip statistics
+
+    READ_TIMEOUT = 0.1  # seconds to wait for the next answer frame of the transceiver
+
+    def __init__(self):
+        self.readTimeout = self.READ_TIMEOUT
+        self.timeouts = 0
+        self.roundTrips = 0
+        self.roundTripTotal = 0.0
+        self.roundTripMin = 0.0
+        self.roundTripMax = 0.0
+        self.reconnects = 0
+
+    def recordRoundTrip(self, seconds):
+        if self.roundTrips == 0 or seconds < self.roundTripMin:
+            self.roundTripMin = seconds
+        if seconds > self.roundTripMax:
+            self.roundTripMax = seconds
+        self.roundTrips += 1
+        self.roundTripTotal += seconds
+
+    def recordTimeout(self):
+        self.timeouts += 1
+
+    # returns count, min, avg, max in seconds, the number of missing answers and of reconnects
+    def getStatistics(self):
+        avg = 0.0
+        if self.roundTrips > 0:
+            avg = self.roundTripTotal / self.roundTrips
+        return {'name': self.name, 'count': self.roundTrips, 'min': self.roundTripMin, 'avg': avg,
+                'max': self.roundTripMax, 'timeouts': self.timeouts, 'reconnects': self.reconnects}
+
+
+class serialTransport(transport):
+
+    def __init__(self, serialDevice, serialBaud):
+        super().__init__()
+        self.name = serialDevice
+        # start serial usb connection
+        self.ser = serial.Serial(serialDevice, serialBaud)
+
+    def write(self, b):
+        return self.ser.write(b)
+
+    def inWaiting(self):
+        return self.ser.inWaiting()
+
+    def read(self, size=1):
+        return self.ser.read(size)
+
+    def close(self):
+        self.ser.close()
+
+
+class tcpTransport(transport):
+    # raw CI-V over tcp (ser2net raw mode or similar), the connection is kept open and
+    # reestablished on failure, so the icom object and its state survives a network drop
+
+    RECONNECT_DELAY = 1.0  # seconds between reconnect attempts
+    CONNECT_TIMEOUT = 3.0  # a connect which is not established after this time is given up
+    CONNECT_WAIT = 0.02  # seconds a write or read waits for a pending connect, the tuning must not stall
+    READ_TIMEOUT = 0.5  # a remote serial server adds network latency to every answer
+
+    def __init__(self, host, port, readTimeout=None):
+        super().__init__()
+        self.name = 'tcp://' + host + ':' + str(port)
+        self.host = host
+        self.port = port
+        if readTimeout is not None:
+            self.readTimeout = readTimeout
+        self.sock = None  # connected on first use, so a server which is down does not stop us
+        self.pendingSock = None  # non-blocking connect in progress
+        self.isConnected = False
+        self.buffer = bytearray()
+        self.lastConnectTry = 0.0
+
+    # starts a non-blocking connect, it is finished by __finishConnect
+    def __startConnect(self):
+        self.lastConnectTry = time.time()
+        family, socktype, proto, canonname, address = socket.getaddrinfo(self.host, self.port, 0,
+                                                                        socket.SOCK_STREAM)[0]
+        sock = socket.socket(family, socktype, proto)
+        sock.setblocking(False)
+        error = sock.connect_ex(address)
+        if error not in [0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN]:
+            sock.close()
+            raise OSError(error, os.strerror(error))
+        self.pendingSock = sock
+
+    # waits at most CONNECT_WAIT for the pending connect, returns True when it is established
+    def __finishConnect(self):
+        sock = self.pendingSock
+        if not select.select([], [sock], [], self.CONNECT_WAIT)[1]:
+            if time.time() - self.lastConnectTry < self.CONNECT_TIMEOUT:
+                return False
+            self.pendingSock = None
+            sock.close()
+            raise OSError(errno.ETIMEDOUT, 'connect timed out')
+        self.pendingSock = None
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error != 0:
+            sock.close()
+            raise OSError(error, os.strerror(error))
+        sock.setblocking(True)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+        self.buffer = bytearray()
+        return True
+
+    def __disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    # never blocks longer than CONNECT_WAIT, returns False until the connection is there
+    def __reconnect(self):
+        self.__disconnect()
+        try:
+            if self.pendingSock is None:
+                if time.time() - self.lastConnectTry < self.RECONNECT_DELAY:
+                    return False
+                self.__startConnect()
+            if not self.__finishConnect():
+                return False
+        except OSError as e:
+            print('CI-V tcp connect to ' + self.name + ' failed: ' + str(e))
+            return False
+        if self.isConnected:
+            self.reconnects += 1
+            print('CI-V tcp reconnected to ' + self.name)
+        else:
+            print('CI-V tcp connected to ' + self.name)
+        self.isConnected = True
+        return True
+
+    def write(self, b):
+        for attempt in range(2):
+            if self.sock is None and not self.__reconnect():
+                return 0
+            try:
+                self.sock.sendall(b)
+                return len(b)
+            except OSError:
+                self.__disconnect()
+                self.lastConnectTry = 0.0
+        return 0
+
+    def inWaiting(self):
+        if self.sock is None:
+            self.__reconnect()
+            return len(self.buffer)
+        try:
+            while select.select([self.sock], [], [], 0)[0]:
+                data = self.sock.recv(4096)
+                if not data:  # server closed the connection
+                    self.__reconnect()
+                    break
+                self.buffer.extend(data)
+        except OSError:
+            self.__reconnect()
+        return len(self.buffer)
+
+    def read(self, size=1):
+        if len(self.buffer) == 0 and self.inWaiting() == 0:
+            return b''
+        b = bytes(self.buffer[0:size])
+        del self.buffer[0:size]
+        return b
+
+    def close(self):
+        self.__disconnect()
+        if self.pendingSock is not None:
+            self.pendingSock.close()
+            self.pendingSock = None
+
+
+# CI-V frequency data (5 bytes bcd, lowest digits first) as string without leading zero
+def frequenceFromBcd(b):
+    c = ''
+    for a in reversed(b[0:5]):
+        c = c + '%0.2X' % a
+    if len(c) > 0 and c[0] == '0':
+        c = c[1:len(c)]
+    return c
+
+
+# frequency as string in hertz to CI-V frequency data (5 bytes bcd, lowest digits first)
+def frequenceToBcd(freq):
+    freq = '0000000000' + freq
+    freq = freq[-10:]
+    return bytes([int(freq[8:10], 16), int(freq[6:8], 16), int(freq[4:6], 16),
+                  int(freq[2:4], 16), int(freq[0:2], 16)])
+
+
+# 'tcp://host:port' or 'tcp://host:port?timeout=0.8' (read timeout in seconds) gives a tcp transport
+def openTransport(serialDevice, serialBaud):
+    if serialDevice.startswith('tcp://'):
+        address = serialDevice[len('tcp://'):]
+        readTimeout = None
+        if '?timeout=' in address:
+            address, readTimeout = address.split('?timeout=', 1)
+            readTimeout = float(readTimeout)
+        host, port = address.rsplit(':', 1)
+        return tcpTransport(host, int(port), readTimeout)
+    return serialTransport(serialDevice, serialBaud)
+
+
 class icom:
 
-    def __init__(self, serialDevice, serialBaud, icomTrxCivAdress):
+    def __init__(self, serialDevice, serialBaud, icomTrxCivAdress, civTransport=None):
         self.icomTrxCivAdress = icomTrxCivAdress
         self.serialDevice = serialDevice
         self.serialBaud = serialBaud
-        # start serial usb connection
-        self.ser = serial.Serial(serialDevice, serialBaud)
+        # start serial usb or tcp connection
+        if civTransport is None:
+            civTransport = openTransport(serialDevice, serialBaud)
+        self.ser = civTransport
+        self.transceiveFrequence = ''
+        self.buffer = bytearray()  # received bytes which are not a complete frame yet
 
-    # gives a empty bytearray when data crc is not valid
-    def __readFromIcom(self):
-        time.sleep(0.04)
+    # gives a empty bytearray when no valid answer frame came back
+    def __writeToIcom(self, b):
+        payload = self.__exchange([b])[0]
+        # print('   * writeToIcom value: ', b, ' answer: ', payload)
+        if len(payload) == 0:
+            return bytearray()
+        return bytearray([254, 254, 0, self.icomTrxCivAdress]) + payload + bytearray([253])
+
+    # reads the bytes the transceiver has send until now into the buffer
+    def __readPending(self):
+        waiting = self.ser.inWaiting()
+        if waiting:
+            self.buffer = self.buffer + self.ser.read(waiting)
+
+    # writes the commands as one block and waits for the answer frames (FE FE 00 <trx> ... FD),
+    # the wait ends when all commands are answered or no frame came within the read timeout of the transport
+    # returns the payload of the answer of every command (command and data, without adresses and FD),
+    # b'' if missing
+    def __exchange(self, commands):
         b = bytearray()
-        while self.ser.inWaiting():
-            b = b + self.ser.read()
-        # drop all but the last frame
-        while b.count(b'\xfd') > 1:
-            del b[0:b.find(b'\xfd') + 1]
-        if len(b) > 0:
-            # valid message
-            validMsg = bytes([254, 254, 0, self.icomTrxCivAdress, 251, 253])
-            if b[0:5] == validMsg:
-                b = b[6:len(b)]
-                if len(b) > 0:  # read answer from icom trx
-                    if b[0] == 254 and b[1] == 254 and b[-1] == 253:  # check for valid data CRC
-                        return b
-                    else:
-                        b = bytearray()
-                else:
-                    b = bytearray()
+        for command in commands:
+            b = b + bytes([254, 254, self.icomTrxCivAdress, 0]) + command + bytes([253])
+        # late answers of an earlier command would be taken for this one, only a frequency the icom
+        # send on its own is kept
+        self.__readPending()
+        self.__takeFrames(self.buffer, [])
+        self.buffer = bytearray()
+        start = time.time()
+        if self.ser.write(bytes(b)) == 0:  # link is down
+            return [b''] * len(commands)
+        frames = []
+        deadline = start + self.ser.readTimeout
+        while len(frames) < len(commands) and time.time() < deadline:
+            self.__readPending()
+            count = len(frames)
+            self.__takeFrames(self.buffer, frames)
+            if len(frames) > count:
+                if count == 0:
+                    self.ser.recordRoundTrip(time.time() - start)
+                deadline = time.time() + self.ser.readTimeout
             else:
-                if b[0] == 254 and b[1] == 254 and b[-1] == 253:  # check for valid data CRC
-                    b = b
-                else:
-                    b = bytearray()
-        # print('   * readFromIcom return value: ', b)
-        return b
-        
-    # gives a empty bytearray when data crc is not valid
-    def __writeToIcom(self, b):
-        s = self.ser.write(bytes([254, 254, self.icomTrxCivAdress, 0]) + b + bytes([253]))
-        # print('   * writeToIcom value: ', b)
-        return self.__readFromIcom()
+                time.sleep(0.001)
+        if len(frames) < len(commands):
+            self.ser.recordTimeout()
+        return self.__matchAnswers(commands, frames)
+
+    # gives every answer to the command it belongs to: a data answer starts with the command and
+    # subcommand of its query, OK (FB) and NG (FA) are given in the order of the commands to the rest
+    def __matchAnswers(self, commands, frames):
+        answers = [b''] * len(commands)
+        for frame in frames:
+            if frame[0] not in [250, 251]:
+                for i, command in enumerate(commands):
+                    if len(answers[i]) == 0 and len(frame) > len(command) and frame.startswith(command):
+                        answers[i] = frame
+                        break
+        for frame in frames:
+            if frame[0] in [250, 251]:
+                for i in range(len(commands)):
+                    if len(answers[i]) == 0:
+                        answers[i] = frame
+                        break
+        return answers
+
+    # moves the complete frames from b to answers, a frequency the icom send on its own
+    # (CI-V TRANSCEIVE) is kept in transceiveFrequence
+    def __takeFrames(self, b, answers):
+        while b.count(b'\xfd') > 0:
+            end = b.find(b'\xfd')
+            frame = b[0:end + 1]
+            del b[0:end + 1]
+            start = frame.rfind(b'\xfe\xfe')
+            if start < 0:
+                continue
+            frame = frame[start:len(frame)]
+            # FE FE 00 <trx> <cmd> ... FD, cmd 00 and 01 are transceive broadcasts
+            if len(frame) > 5 and frame[2] == 0 and frame[3] == self.icomTrxCivAdress:
+                if frame[4] == 0 and len(frame) == 11:
+                    self.transceiveFrequence = frequenceFromBcd(frame[5:10])
+                elif frame[4] != 1:
+                    answers.append(bytes(frame[4:-1]))
+
+    # CI-V TRANSCEIVE have to be ON
+    # gives the last frequency the icom send us when a user is dailing without waiting, '' when there was none
+    def pollTransceiveFrequence(self):
+        self.__readPending()
+        self.__takeFrames(self.buffer, [])
+        freq = self.transceiveFrequence
+        self.transceiveFrequence = ''
+        return freq
+
+    # sends all commands in one write and collects the answers in one read, pending answers of earlier
+    # commands are thrown away before, every answer is given to the command it belongs to
+    # returns one answer payload per command, an empty bytes object for a missing answer
+    def queryBatch(self, commands):
+        return self.__exchange(commands)
 
     def close(self):
         self.ser.close()
 
+    def getTransportStatistics(self):
+        return self.ser.getStatistics()
+
     def setMode(self, mode):
         mode = mode.upper()
         if mode == 'FM':
@@ -227,26 +519,14 @@ class icom:
     # CI-V TRANSCEIVE have to be ON
     # function extract last frequency which is send to us when a user is dailing
     def getWhatFrequencyIcomSendUs(self):
-        c = ''
-        b = self.__readFromIcom()
-        # find last CI-V message by searching from behind
-        position = b.rfind(bytearray(b'\xfe\xfe'))
-        if position >= 0:
-            # extract answer
-            answer = b[position:len(b)]
-            # proof if CI-V frequence message from icom
-            if len(answer) == 11 and answer[4] == 0:
-                if len(answer) > 0:
-                    for a in reversed(answer[5:10]):
-                        c = c + '%0.2X' % a
-                if c[0] == '0':
-                    c = c[1:len(c)]
-        return c
+        self.__readPending()
+        self.__takeFrames(self.buffer, [])
+        return self.transceiveFrequence
 
     def isPttOff(self):
         ret = True
         b = self.__writeToIcom(b'\x1C\x00')  # ask for PTT status
-        if b[-2] == 1:
+        if len(b) > 0 and b[-2] == 1:
             ret = False
         return ret
 
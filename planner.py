@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+"""
+Date    : 10/2026
+
+Offline planner for FREQUENCY_OFFSET_UPLINK, FREQUENCY_OFFSET_DOWNLINK (gp2icom.py) and the update
+interval of gpredict. For every entry in satellites.txt a set of passes (different maximum elevations)
+is simulated at once with numpy. The doppler curves of uplink and downlink are sampled at the gpredict
+update interval and a CI-V write is counted whenever the shift is greater than the offset, like the
+tracking engine in gp2icom.py does it.
+
+For every combination of interval and offsets the planner predicts:
+- CI-V writes per second (mean over the passes)
+- peak occupancy of the CI-V link: share of one second the engine waits for the transceiver
+  (batches * BATCH_TIME + commands * COMMAND_TIME)
+- peak wire load of the serial link at BAUD
+- worst case tuning error on uplink and downlink in Hz
+
+The table shows the cheapest setting (fewest writes) that keeps a satellite within its error target
+and below MAX_OCCUPANCY. The last row is the one setting of gp2icom.py which works for all satellites
+in satellites.txt, or tells that there is none.
+
+Usage:
+python planner.py
+python planner.py -measure /dev/ic9700a 162   (measures BATCH_TIME and COMMAND_TIME with icom.py first)
+
+Requirements: numpy
+"""
+
+import sys
+import time
+import numpy as np
+from satellite import readSatellites
+
+SPEED_OF_LIGHT = 299792458.0  # m/s
+EARTH_RADIUS = 6371000.0  # m
+EARTH_MU = 3.986004418e14  # m^3/s^2
+
+ALTITUDE = 500000.0  # m, circular low earth orbit
+MAX_ELEVATIONS = [10, 20, 30, 45, 60, 75, 89]  # degree, one pass per maximum elevation
+BAND_FREQUENCY = {'V': 145900000.0, 'U': 435500000.0, 'L': 1268000000.0}  # Hz, center of the satellite segment
+
+# tuning error target in Hz for the mode in satellites.txt
+ERROR_TARGET = {'SSB': 100, 'CW': 100, 'SSB-D': 50, 'FM': 1500, 'FM-D': 1000}
+
+INTERVALS = [0.25, 0.5, 0.8, 1.0, 2.0, 5.0, 10.0]  # s, update interval in gpredict
+OFFSETS = [10, 25, 40, 60, 100, 200, 500, 1000]  # Hz, candidates for FREQUENCY_OFFSET_UPLINK/DOWNLINK
+
+BAUD = 115200
+# a CI-V batch (one write, read until all answers are there) takes BATCH_TIME + commands * COMMAND_TIME,
+# estimates for usb at 115200 baud, use -measure for the real values of a transceiver
+BATCH_TIME = 0.005  # s
+COMMAND_TIME = 0.008  # s
+MAX_OCCUPANCY = 0.75  # share of time the tracking engine may wait for the transceiver
+
+# CI-V commands send by gp2icom.py as (data bytes send, data bytes answered), a frame adds 5 bytes
+# duplex: all commands of one gpredict cycle are one CI-V batch, SUB is only asked when the cached
+#         frequency is older than a second, uplink is setVFO MAIN, setFrequence, setVFO SUB, downlink
+#         is setVFO SUB, setFrequence, query is setVFO SUB, getFrequence. The setVFO SUB at the end of
+#         the uplink is not send twice when the downlink or the query follows.
+# simplex: every command is a batch of its own, every write asks for PTT first, uplink on ic9700 uses
+#          the unselected VFO command
+CIV_COMMANDS = {
+    True: {'query': [(2, 1), (1, 6)], 'up': [(2, 1), (6, 1), (2, 1)], 'down': [(2, 1), (6, 1)]},
+    False: {'query': [], 'up': [(2, 3), (7, 1)], 'down': [(2, 3), (2, 1), (6, 1)]},
+}
+CACHE_MAX_AGE = 1.0  # s, see SUB_FREQUENCY_MAX_AGE in gp2icom.py
+
+
+# measures the duplex batch of one gpredict cycle (07 d0, 05, 07 d1, 05) and a batch with one command,
+# the transceiver is set to the frequencies it already has
+# returns BATCH_TIME and COMMAND_TIME in seconds, the median of count measurements
+def measureBatchTime(device, civAdress, count=20):
+    import icom
+    icomTrx = icom.icom(device, str(BAUD), civAdress)
+    try:
+        answers = icomTrx.queryBatch([b'\x07\xd0', b'\x03', b'\x07\xd1', b'\x03'])
+        if len(answers[1]) < 6 or len(answers[3]) < 6:
+            sys.exit('no frequency answer from the transceiver')
+        duplexBatch = [b'\x07\xd0', b'\x05' + answers[1][1:6], b'\x07\xd1', b'\x05' + answers[3][1:6]]
+        batchTimes = []
+        commandTimes = []
+        for i in range(count):
+            start = time.time()
+            icomTrx.queryBatch(duplexBatch)
+            batchTimes.append(time.time() - start)
+            start = time.time()
+            icomTrx.queryBatch([b'\x07\xd1'])
+            commandTimes.append(time.time() - start)
+        duplexTime = float(np.median(batchTimes))
+        singleTime = float(np.median(commandTimes))
+        commandTime = max(0.0, (duplexTime - singleTime) / (len(duplexBatch) - 1))
+        return max(0.0, singleTime - commandTime), commandTime
+    finally:
+        icomTrx.close()
+
+
+# range rate in m/s for all passes (rows) at the times t (columns), t = 0 is the culmination
+# returns range rate and a mask of the times where the satellite is above the horizon
+def rangeRate(maxElevations, t):
+    r = EARTH_RADIUS + ALTITUDE
+    w = np.sqrt(EARTH_MU / r ** 3)
+    e = np.radians(np.asarray(maxElevations, dtype=float))[:, None]
+    # earth central angle between station and orbit plane
+    beta = np.arccos(EARTH_RADIUS * np.cos(e) / r) - e
+    wt = w * np.asarray(t)[None, :]
+    distance = np.sqrt(r ** 2 + EARTH_RADIUS ** 2 - 2 * r * EARTH_RADIUS * np.cos(beta) * np.cos(wt))
+    rate = r * w * EARTH_RADIUS * np.cos(beta) * np.sin(wt) / distance
+    visible = np.cos(wt) > EARTH_RADIUS / (r * np.cos(beta))
+    return rate, visible
+
+
+def passHalfDuration(maxElevation):
+    r = EARTH_RADIUS + ALTITUDE
+    w = np.sqrt(EARTH_MU / r ** 3)
+    e = np.radians(maxElevation)
+    beta = np.arccos(EARTH_RADIUS * np.cos(e) / r) - e
+    return np.arccos(EARTH_RADIUS / (r * np.cos(beta))) / w
+
+
+# follows the frequency curve f (passes x updates) like the tracking engine for all offsets at once
+# returns writes (passes x updates x offsets) and the worst tuning error (passes x offsets)
+def simulateLink(f, visible, offsets):
+    offsets = np.asarray(offsets, dtype=float)[None, :]
+    passes, updates = f.shape
+    last = np.zeros((passes, offsets.shape[1]))
+    tuned = np.zeros((passes, updates, offsets.shape[1]))
+    writes = np.zeros((passes, updates, offsets.shape[1]), dtype=bool)
+    # the threshold makes every update depend on the last write, so only the time is a loop
+    for k in range(updates):
+        fresh = f[:, k][:, None]
+        write = visible[:, k][:, None] & (np.abs(fresh - last) > offsets)
+        last = np.where(write, fresh, last)
+        writes[:, k, :] = write
+        tuned[:, k, :] = last
+    # the frequency drifts away until the next update, the curve is monotone so the ends are the worst
+    following = np.concatenate([f[:, 1:], f[:, -1:]], axis=1)
+    drift = np.maximum(np.abs(f[:, :, None] - tuned), np.abs(following[:, :, None] - tuned))
+    error = np.where(visible[:, :, None], drift, 0.0).max(axis=1)
+    return writes, error
+
+
+def civCost(commands):
+    count = len(commands)
+    wireBytes = sum(send + answer + 10 for send, answer in commands)
+    return count, wireBytes
+
+
+# all combinations of interval and offsets for a satellite, returns the error target and the results
+def simulateSatellite(sat, batchTime, commandTime):
+    bands = sat.satmode.split('/')
+    duplex = bands[0] != bands[1]
+    upFrequency = BAND_FREQUENCY[bands[0]]
+    downFrequency = BAND_FREQUENCY[bands[1]]
+    target = ERROR_TARGET.get(sat.mode, 100)
+    cost = CIV_COMMANDS[duplex]
+    queryCommands, queryBytes = civCost(cost['query'])
+    upCommands, upBytes = civCost(cost['up'])
+    downCommands, downBytes = civCost(cost['down'])
+
+    halfDuration = max(passHalfDuration(e) for e in MAX_ELEVATIONS)
+    results = []
+    for interval in INTERVALS:
+        t = np.arange(-halfDuration, halfDuration + interval, interval)
+        rate, visible = rangeRate(MAX_ELEVATIONS, t)
+        # uplink is precorrected so the satellite receives upFrequency, downlink is received shifted
+        up = upFrequency / (1 - rate / SPEED_OF_LIGHT)
+        down = downFrequency * (1 - rate / SPEED_OF_LIGHT)
+        upWrites, upError = simulateLink(up, visible, OFFSETS)
+        downWrites, downError = simulateLink(down, visible, OFFSETS)
+
+        queries = visible
+        if duplex:
+            expiry = max(1, int(np.ceil(CACHE_MAX_AGE / interval)))
+            queries = visible & (np.arange(visible.shape[1]) % expiry == 0)[None, :]
+        # busy time and bytes per update for every uplink (axis 2) and downlink (axis 3) offset
+        q = queries[:, :, None, None]
+        u = upWrites[:, :, :, None]
+        d = downWrites[:, :, None, :]
+        commands = queryCommands * q + upCommands * u + downCommands * d
+        wire = queryBytes * q + upBytes * u + downBytes * d
+        if duplex:
+            selectTwice = u & (d | q)
+            commands = commands - selectTwice
+            wire = wire - 13 * selectTwice
+            busy = batchTime * (q | u | d) + commandTime * commands
+        else:
+            busy = (batchTime + commandTime) * commands
+        # peak over a window of about one second
+        window = max(1, int(round(1.0 / interval)))
+        busySum = np.cumsum(busy, axis=1)
+        wireSum = np.cumsum(wire, axis=1)
+        busyWindow = busySum[:, window - 1:] - np.concatenate(
+            [np.zeros_like(busySum[:, :1]), busySum[:, :-window]], axis=1)
+        wireWindow = wireSum[:, window - 1:] - np.concatenate(
+            [np.zeros_like(wireSum[:, :1]), wireSum[:, :-window]], axis=1)
+        occupancy = busyWindow.max(axis=(0, 1)) / (window * interval)
+        wireLoad = wireWindow.max(axis=(0, 1)) * 10.0 / BAUD / (window * interval)
+
+        visibleTime = visible.sum() * interval
+        writesPerSecond = (upWrites.sum(axis=(0, 1))[:, None] + downWrites.sum(axis=(0, 1))[None, :]) / visibleTime
+        worstUp = upError.max(axis=0)
+        worstDown = downError.max(axis=0)
+
+        for i, upOffset in enumerate(OFFSETS):
+            for j, downOffset in enumerate(OFFSETS):
+                results.append({'interval': interval, 'up': upOffset, 'down': downOffset,
+                                'writes': writesPerSecond[i, j], 'occupancy': occupancy[i, j],
+                                'wire': wireLoad[i, j], 'upError': worstUp[i], 'downError': worstDown[j]})
+
+    return target, results
+
+
+def isFeasible(target, result):
+    return max(result['upError'], result['downError']) <= target and result['occupancy'] <= MAX_OCCUPANCY
+
+
+# the cheapest setting within the target, returns target, best and if the target is reachable
+def planSatellite(target, results):
+    feasible = [r for r in results if isFeasible(target, r)]
+    if feasible:
+        # fewest writes, then the longest interval and the biggest offsets
+        best = min(feasible, key=lambda r: (round(r['writes'], 2), -r['interval'], -r['up'], -r['down']))
+        return target, best, True
+    best = min(results, key=lambda r: (max(r['upError'], r['downError']), r['occupancy']))
+    return target, best, False
+
+
+# the setting which keeps all satellites within their target with the fewest writes of the busiest
+# satellite, simulations is a list of (target, results) with the same order of the results
+# returns the worst values of all satellites for this setting or None
+def planCommonSetting(simulations):
+    common = None
+    for k in range(len(simulations[0][1])):
+        if not all(isFeasible(target, results[k]) for target, results in simulations):
+            continue
+        worst = dict(simulations[0][1][k])
+        for key in ['writes', 'occupancy', 'wire', 'upError', 'downError']:
+            worst[key] = max(results[k][key] for target, results in simulations)
+        if common is None or ((round(worst['writes'], 2), -worst['interval'], -worst['up'], -worst['down'])
+                              < (round(common['writes'], 2), -common['interval'], -common['up'], -common['down'])):
+            common = worst
+    return common
+
+
+def main():
+    batchTime = BATCH_TIME
+    commandTime = COMMAND_TIME
+    if len(sys.argv) > 3 and sys.argv[1].upper() == '-MEASURE':
+        batchTime, commandTime = measureBatchTime(sys.argv[2], int(sys.argv[3]))
+        print('measured CI-V batch: %.1f ms + %.1f ms per command' % (batchTime * 1000, commandTime * 1000))
+
+    print('passes with max. elevation %s degree, %d km altitude, CI-V batch %.1f ms + %.1f ms per command, %d baud'
+          % (MAX_ELEVATIONS, ALTITUDE / 1000, batchTime * 1000, commandTime * 1000, BAUD))
+    print('%-14s %-5s %6s %8s %6s %6s %8s %8s %7s %8s %8s' % ('satellite', 'bands', 'target', 'interval', 'up',
+                                                             'down', 'writes/s', 'civ busy', 'wire', 'up err',
+                                                             'down err'))
+    simulations = {}  # satellites with the same bands and mode have the same plan
+    for sat in readSatellites('satellites.txt'):
+        if (sat.satmode, sat.mode) not in simulations:
+            simulations[(sat.satmode, sat.mode)] = simulateSatellite(sat, batchTime, commandTime)
+        target, best, ok = planSatellite(*simulations[(sat.satmode, sat.mode)])
+        print('%-14s %-5s %5dHz %7.2fs %4dHz %4dHz %8.2f %7.0f%% %6.1f%% %6.0fHz %6.0fHz %s'
+              % (sat.name, sat.satmode, target, best['interval'], best['up'], best['down'], best['writes'],
+                 best['occupancy'] * 100, best['wire'] * 100, best['upError'], best['downError'],
+                 '' if ok else '! target not reachable'))
+
+    # gp2icom.py has one FREQUENCY_OFFSET_UPLINK/DOWNLINK and gpredict one interval for all satellites
+    common = planCommonSetting(list(simulations.values()))
+    if common is None:
+        print('%-14s ! no setting keeps all satellites within their target' % 'all')
+    else:
+        print('%-14s %-5s %6s %7.2fs %4dHz %4dHz %8.2f %7.0f%% %6.1f%% %6.0fHz %6.0fHz'
+              % ('all', '', '', common['interval'], common['up'], common['down'], common['writes'],
+                 common['occupancy'] * 100, common['wire'] * 100, common['upError'], common['downError']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""
+Date    : 10/2026
+Comments: satellites.txt is read by gp2icom.py and planner.py, one satellite per line:
+          name,mode,rit,satmode like 'SO-50,FM,0,V/U'
+"""
+
+
+class Satellite:
+    name = ""
+    mode = ""  # SSB, FM, CW
+    satmode = ""  # U/V, V/U, S/U, U/U, V/V
+    rit = 0
+
+
+def readSatellites(filename):
+    satellites = []
+    with open(filename, 'r') as fp:
+        for line in fp:
+            if len(line.strip()) == 0:
+                continue
+            new_satellite = Satellite()
+            new_satellite.name = line.split(",")[0] + " " + line.split(",")[1]
+            new_satellite.mode = line.split(",")[1]
+            new_satellite.rit = line.split(",")[2]
+            new_satellite.satmode = line.split(",")[3].replace("\n", "").upper()
+            satellites.append(new_satellite)
+    return satellites